@@ -8,12 +8,44 @@ import json
 import logging
 import os
 import sys
-from typing import Any, Dict, List
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
 
+import aiohttp
 from polygon import RESTClient
 from mcp.server.stdio import stdio_server
 from mcp import types
-from mcp.server import Server
+from mcp.server import InitializationOptions, Server
+
+# Bind JSON helpers once to the fastest available library: orjson, then ujson,
+# then the stdlib. _dumps renders indented JSON text; _loads parses raw bytes.
+try:
+    import orjson
+
+    def _dumps(data: Any) -> str:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2).decode()
+
+    _loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+
+        def _dumps(data: Any) -> str:
+            return ujson.dumps(data, indent=2, escape_forward_slashes=False)
+
+        _loads = ujson.loads
+    except ImportError:
+        def _dumps(data: Any) -> str:
+            return json.dumps(data, indent=2)
+
+        _loads = json.loads
+
+try:
+    import ormsgpack
+except ImportError:  # request JSON from the HTTP server instead
+    ormsgpack = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, stream=sys.stderr)
@@ -22,9 +54,101 @@ logger = logging.getLogger(__name__)
 # Create server instance
 server = Server("polygon-direct")
 
+
+def _decode_payload(content_type: str, body: bytes) -> Any:
+    """Decode an HTTP server response body sent as JSON or MessagePack"""
+    if content_type == "application/msgpack":
+        return ormsgpack.unpackb(body)
+    return _loads(body)
+
+
 # Global client instance
 polygon_client = None
 
+# Base URL of the local polygon HTTP server
+HTTP_BASE_URL = f"http://{os.getenv('POLY_MCP_HOST', 'localhost')}:{os.getenv('POLY_MCP_PORT', '3000')}"
+
+# Ask the HTTP server for MessagePack when we can decode it; the payload is
+# only re-rendered as JSON text for the MCP client, so the wire format is free
+HTTP_ACCEPT = "application/msgpack" if ormsgpack is not None else "application/json"
+
+# Shared HTTP session, created lazily inside the running event loop
+_session: Optional[aiohttp.ClientSession] = None
+
+async def _get_session() -> aiohttp.ClientSession:
+    """Return the shared HTTP session, creating it on first use"""
+    global _session
+
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=50, limit_per_host=50, keepalive_timeout=60)
+        _session = aiohttp.ClientSession(connector=connector)
+    return _session
+
+# Retries for transient connection errors on idempotent GETs
+_HTTP_RETRIES = 2
+_HTTP_RETRY_BACKOFF = 0.1
+
+async def _get_with_retry(url: str, **kwargs: Any) -> Tuple[int, str, bytes]:
+    """GET a URL, retrying transient connection errors with backoff
+
+    Returns the status, content type and body. HTTP error statuses and
+    timeouts are returned or raised as-is, not retried.
+    """
+    session = await _get_session()
+    for attempt in range(_HTTP_RETRIES + 1):
+        try:
+            async with session.get(url, **kwargs) as response:
+                return response.status, response.content_type, await response.read()
+        except aiohttp.ServerTimeoutError:
+            raise
+        except aiohttp.ClientConnectionError as e:
+            if attempt == _HTTP_RETRIES:
+                raise
+            logger.warning("Retrying %s after connection error: %s", url, e)
+            await asyncio.sleep(_HTTP_RETRY_BACKOFF * 2 ** attempt)
+
+# LRU cache of rendered list_aggs results for past windows. Split-adjusted
+# bars can still change, so entries expire like the server's max-age.
+_AGGS_CACHE_MAXSIZE = 512
+_AGGS_CACHE_TTL = 86400
+_aggs_cache: "OrderedDict[tuple, Tuple[float, str]]" = OrderedDict()
+
+def _aggs_cache_get(key: tuple) -> Optional[str]:
+    """Return an unexpired cached list_aggs result and mark it most recently used"""
+    entry = _aggs_cache.get(key)
+    if entry is None:
+        return None
+    stored_at, result = entry
+    if time.monotonic() - stored_at > _AGGS_CACHE_TTL:
+        del _aggs_cache[key]
+        return None
+    _aggs_cache.move_to_end(key)
+    return result
+
+def _aggs_cache_key(params: Dict[str, Any]) -> Optional[tuple]:
+    """Return the cache key for list_aggs params, or None if not cacheable
+
+    Only windows whose `to` is a YYYY-MM-DD date before today are cached.
+    """
+    to_date = params["to"]
+    if not isinstance(to_date, str):
+        return None
+    try:
+        if date.fromisoformat(to_date) >= date.today():
+            return None
+        key = tuple(params.items())
+        hash(key)
+    except (TypeError, ValueError):
+        return None
+    return key
+
+def _aggs_cache_put(key: tuple, result: str) -> None:
+    """Store a list_aggs result, evicting the least recently used entry"""
+    _aggs_cache[key] = (time.monotonic(), result)
+    _aggs_cache.move_to_end(key)
+    if len(_aggs_cache) > _AGGS_CACHE_MAXSIZE:
+        _aggs_cache.popitem(last=False)
+
 def initialize_polygon_client():
     """Initialize the Polygon.io client"""
     global polygon_client
@@ -39,56 +163,118 @@ def initialize_polygon_client():
     polygon_client = "initialized"
     logger.info("Polygon client initialized (mock mode)")
 
+# Tool definitions are static, so build them once at import
+_TOOLS = [
+    types.Tool(
+        name="list_aggs",
+        description="Fetch aggregate bars (OHLCV data) for a stock ticker",
+        inputSchema={
+            "type": "object", 
+            "properties": {
+                "ticker": {"type": "string", "description": "Stock ticker symbol"},
+                "from_date": {"type": "string", "description": "Start date (YYYY-MM-DD)"},
+                "to_date": {"type": "string", "description": "End date (YYYY-MM-DD)"},
+                "timespan": {"type": "string", "description": "Time window", "default": "day"}
+            },
+            "required": ["ticker"]
+        }
+    ),
+    types.Tool(
+        name="list_aggs_batch",
+        description="Fetch aggregate bars (OHLCV data) for several tickers or date ranges in one request",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "queries": {
+                    "type": "array",
+                    "description": "List of list_aggs queries",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "ticker": {"type": "string", "description": "Stock ticker symbol"},
+                            "from_date": {"type": "string", "description": "Start date (YYYY-MM-DD)"},
+                            "to_date": {"type": "string", "description": "End date (YYYY-MM-DD)"},
+                            "timespan": {"type": "string", "description": "Time window", "default": "day"}
+                        },
+                        "required": ["ticker"]
+                    }
+                }
+            },
+            "required": ["queries"]
+        }
+    )
+]
+
+# Default HTTP server query params for list_aggs tool calls
+_LIST_AGGS_DEFAULTS = {
+    "ticker": "AAPL",
+    "from": "2024-01-01",
+    "to": "2024-12-31",
+    "timespan": "day",
+    "multiplier": 1,
+    "max_results": 100
+}
+
+# Tool argument names mapped to the HTTP server query params they override
+_LIST_AGGS_ARGUMENTS = {
+    "ticker": "ticker",
+    "from_date": "from",
+    "to_date": "to",
+    "timespan": "timespan"
+}
+
+def _list_aggs_params(arguments: dict) -> Dict[str, Any]:
+    """Build HTTP server query params from list_aggs tool arguments
+
+    Arguments set to None fall back to the defaults, as aiohttp rejects None
+    query values.
+    """
+    return _LIST_AGGS_DEFAULTS | {
+        _LIST_AGGS_ARGUMENTS[key]: value
+        for key, value in arguments.items()
+        if key in _LIST_AGGS_ARGUMENTS and value is not None
+    }
+
 @server.list_tools()
 async def handle_list_tools() -> list[types.Tool]:
     """List available tools"""
     logger.info("list_tools called")
     
-    return [
-        types.Tool(
-            name="list_aggs",
-            description="Fetch aggregate bars (OHLCV data) for a stock ticker",
-            inputSchema={
-                "type": "object", 
-                "properties": {
-                    "ticker": {"type": "string", "description": "Stock ticker symbol"},
-                    "from_date": {"type": "string", "description": "Start date (YYYY-MM-DD)"},
-                    "to_date": {"type": "string", "description": "End date (YYYY-MM-DD)"},
-                    "timespan": {"type": "string", "description": "Time window", "default": "day"}
-                },
-                "required": ["ticker"]
-            }
-        )
-    ]
+    return _TOOLS
 
 @server.call_tool()
 async def handle_call_tool(name: str, arguments: dict) -> list[types.TextContent]:
     """Handle tool calls"""
-    logger.info(f"call_tool called: {name} with {arguments}")
+    logger.info("call_tool called: %s with %s", name, arguments)
     
     if name == "list_aggs":
-        # Now make real HTTP request to our polygon server
-        params = {
-            "ticker": arguments.get("ticker", "AAPL"),
-            "from": arguments.get("from_date", "2024-01-01"),
-            "to": arguments.get("to_date", "2024-12-31"),
-            "timespan": arguments.get("timespan", "day"),
-            "multiplier": 1,
-            "max_results": 100
-        }
-        
         try:
-            import requests
-            logger.info(f"Making HTTP request with params: {params}")
-            response = requests.get("http://localhost:3000/v1/list_aggs", params=params, timeout=30)
+            # Now make real HTTP request to our polygon server
+            params = _list_aggs_params(arguments)
+            
+            cache_key = _aggs_cache_key(params)
+            if cache_key is not None:
+                cached = _aggs_cache_get(cache_key)
+                if cached is not None:
+                    logger.info("Returning cached data")
+                    return [types.TextContent(type="text", text=cached)]
             
-            if response.status_code == 200:
-                data = response.json()
-                result = json.dumps(data, indent=2)
-                logger.info(f"HTTP request successful, returning real data")
+            logger.info("Making request to %s/v1/list_aggs with params: %s", HTTP_BASE_URL, params)
+            status, content_type, body = await _get_with_retry(
+                f"{HTTP_BASE_URL}/v1/list_aggs",
+                params=params,
+                headers={"Accept": HTTP_ACCEPT},
+                timeout=aiohttp.ClientTimeout(total=30)
+            )
+            if status == 200:
+                data = _decode_payload(content_type, body)
+                result = _dumps(data)
+                if cache_key is not None:
+                    _aggs_cache_put(cache_key, result)
+                logger.info("HTTP request successful, returning real data")
                 return [types.TextContent(type="text", text=result)]
             else:
-                error_msg = f"HTTP Error {response.status_code}: {response.text}"
+                error_msg = f"HTTP Error {status}: {body.decode(errors='replace')}"
                 logger.error(error_msg)
                 return [types.TextContent(type="text", text=error_msg)]
                 
@@ -97,6 +283,39 @@ async def handle_call_tool(name: str, arguments: dict) -> list[types.TextContent
             logger.error(error_msg)
             return [types.TextContent(type="text", text=error_msg)]
     
+    if name == "list_aggs_batch":
+        # Send every query in one round trip to the batch endpoint
+        queries = arguments.get("queries")
+        if not isinstance(queries, list) or not all(isinstance(query, dict) for query in queries):
+            error_msg = "Invalid arguments: queries must be a list of objects"
+            logger.error(error_msg)
+            return [types.TextContent(type="text", text=error_msg)]
+        queries = [_list_aggs_params(query) for query in queries]
+        
+        try:
+            logger.info("Making batch HTTP request with %d queries", len(queries))
+            session = await _get_session()
+            async with session.post(
+                f"{HTTP_BASE_URL}/v1/list_aggs:batch",
+                json=queries,
+                headers={"Accept": HTTP_ACCEPT},
+                timeout=aiohttp.ClientTimeout(total=30)
+            ) as response:
+                if response.status == 200:
+                    data = _decode_payload(response.content_type, await response.read())
+                    result = _dumps(data)
+                    logger.info("Batch HTTP request successful, returning real data")
+                    return [types.TextContent(type="text", text=result)]
+                else:
+                    error_msg = f"HTTP Error {response.status}: {await response.text()}"
+                    logger.error(error_msg)
+                    return [types.TextContent(type="text", text=error_msg)]
+                
+        except Exception as e:
+            error_msg = f"Error calling HTTP server: {str(e)}"
+            logger.error(error_msg)
+            return [types.TextContent(type="text", text=error_msg)]
+    
     raise ValueError(f"Unknown tool: {name}")
 
 async def main():
@@ -108,7 +327,6 @@ async def main():
         async with stdio_server() as (read_stream, write_stream):
             logger.info("Direct MCP server initialized")
             # Use proper initialization options instead of empty dict
-            from mcp.server import InitializationOptions
             init_options = InitializationOptions(
                 server_name="polygon-direct",
                 server_version="1.0.0",
@@ -119,6 +337,9 @@ async def main():
     except Exception as e:
         logger.error(f"Server error: {e}")
         raise
+    finally:
+        if _session is not None and not _session.closed:
+            await _session.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -4,14 +4,19 @@ Polygon.io HTTP API Server
 A FastAPI HTTP server for fetching stock market data from Polygon.io
 """
 
+import asyncio
+import hashlib
 import logging
 import os
-from datetime import datetime
-from typing import Dict, List, Optional, Any
+from datetime import date, datetime
+from typing import Dict, List, Optional, Any, Union
 
+import ormsgpack
 import uvicorn
-from fastapi import FastAPI, HTTPException, Query
-from pydantic import BaseModel
+from fastapi import FastAPI, Header, HTTPException, Query, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, Field
 
 from polygon import RESTClient
 
@@ -26,12 +31,27 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="Polygon.io API Server",
     description="HTTP API server for fetching stock market data from Polygon.io",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
+# Compress large aggregate payloads for clients that accept gzip
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # Global client instance
 polygon_client: Optional[RESTClient] = None
 
+# Maximum number of queries accepted by the batch endpoint
+MAX_BATCH_SIZE = 50
+
+# Binary wire format offered to clients that send a matching Accept header
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+# Timespans whose bars are Polygon.io base aggregates themselves. The SDK's
+# limit counts base aggregates, so only for these (with multiplier 1) does a
+# page of `limit` base aggregates hold `limit` bars.
+BASE_TIMESPANS = {"second", "minute", "day"}
+
 
 class AggregateData(BaseModel):
     """Model for aggregate data response"""
@@ -40,7 +60,7 @@ class AggregateData(BaseModel):
     high: float
     low: float
     close: float
-    volume: int
+    volume: Union[int, float]  # fractional for some instruments
     vwap: Optional[float] = None
     transactions: Optional[int] = None
 
@@ -56,6 +76,20 @@ class ListAggsResponse(BaseModel):
     note: Optional[str] = None
 
 
+class ListAggsQuery(BaseModel):
+    """Model for a single query in a list_aggs batch request"""
+    model_config = ConfigDict(populate_by_name=True)
+
+    ticker: str
+    multiplier: int = 1
+    timespan: str = "minute"
+    from_date: str = Field("2023-01-01", alias="from")
+    to_date: str = Field("2023-06-13", alias="to")
+    limit: int = 50000
+    max_results: int = 100
+    include_count: bool = True
+
+
 def initialize_polygon_client():
     """Initialize the Polygon.io client with API key from environment"""
     global polygon_client
@@ -88,6 +122,7 @@ async def root():
         "status": "running",
         "endpoints": {
             "list_aggs": "/v1/list_aggs",
+            "list_aggs_batch": "/v1/list_aggs:batch",
             "health": "/health"
         }
     }
@@ -103,6 +138,163 @@ async def health_check():
     }
 
 
+def agg_row(a: Any) -> Dict[str, Any]:
+    """Convert a polygon aggregate to a plain response row
+
+    Values are coerced to the AggregateData field types without running model
+    validation. The SDK reports volume as a float; whole volumes are sent as
+    integers and fractional volumes are kept as floats rather than truncated.
+    """
+    volume = a.volume
+    if isinstance(volume, float) and volume.is_integer():
+        volume = int(volume)
+    vwap = getattr(a, 'vwap', None)
+    transactions = getattr(a, 'transactions', None)
+    return {
+        "timestamp": int(a.timestamp),
+        "open": float(a.open),
+        "high": float(a.high),
+        "low": float(a.low),
+        "close": float(a.close),
+        "volume": volume,
+        "vwap": float(vwap) if vwap is not None else None,
+        "transactions": int(transactions) if transactions is not None else None
+    }
+
+
+def fetch_aggs(
+    ticker: str,
+    multiplier: int,
+    timespan: str,
+    from_date: str,
+    to_date: str,
+    limit: int,
+    max_results: int,
+    include_count: bool
+) -> Dict[str, Any]:
+    """Fetch aggregate bars from Polygon.io and build the list_aggs payload"""
+    # Without a total count only max_results rows are ever read, so request
+    # pages no larger than that from Polygon.io. This only holds when each bar
+    # is one base aggregate; larger bars would need many more pages.
+    if not include_count and multiplier == 1 and timespan in BASE_TIMESPANS:
+        limit = max(1, min(limit, max_results))
+    
+    # Fetch aggregates using the polygon client, keeping only the rows we
+    # display and counting the rest without materializing them
+    aggs = []
+    total = 0
+    for a in polygon_client.list_aggs(
+        ticker=ticker,
+        multiplier=multiplier,
+        timespan=timespan,
+        from_=from_date,
+        to=to_date,
+        limit=limit
+    ):
+        total += 1
+        if total > max_results:
+            if not include_count:
+                break
+            continue
+        
+        aggs.append(agg_row(a))
+        
+        # Stop before the generator fetches another page we would discard
+        if not include_count and total == max_results:
+            break
+    
+    if not include_count:
+        total = len(aggs)
+    
+    # Note when the response shows fewer aggregates than were counted
+    note = None
+    if total > max_results:
+        note = f"Showing first {max_results} of {total} total aggregates"
+    
+    return {
+        "ticker": ticker,
+        "timespan": f"{multiplier} {timespan}",
+        "from_date": from_date,
+        "to_date": to_date,
+        "count": total,
+        "aggregates": aggs,
+        "note": note
+    }
+
+
+def aggs_etag(
+    ticker: str,
+    multiplier: int,
+    timespan: str,
+    from_date: str,
+    to_date: str,
+    limit: int,
+    max_results: int,
+    include_count: bool,
+    media_type: str
+) -> str:
+    """Build a weak ETag identifying a list_aggs query and its representation
+
+    The ETag is weak because GZipMiddleware serves the same validator for
+    gzip and identity bodies, which a strong ETag must not do. It includes
+    today's date so it rolls over daily, in step with the one-day max-age;
+    otherwise a cache could revalidate a stale body forever.
+    """
+    key = f"{ticker}|{multiplier}|{timespan}|{from_date}|{to_date}|{limit}|{max_results}|{include_count}|{media_type}|{date.today().isoformat()}"
+    return f'W/"{hashlib.blake2b(key.encode(), digest_size=16).hexdigest()}"'
+
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    """Weakly compare an ETag against an If-None-Match header"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def is_past_date(value: str) -> bool:
+    """Return True if value is a YYYY-MM-DD date before today
+
+    Anything else, such as a millisecond timestamp, is treated as not past.
+    """
+    try:
+        return date.fromisoformat(value) < date.today()
+    except ValueError:
+        return False
+
+
+def negotiate_media_type(accept: Optional[str]) -> str:
+    """Pick MessagePack when the client explicitly accepts it, otherwise JSON
+
+    Only an exact application/msgpack media range counts; q=0 (or an
+    unparseable q) refuses it.
+    """
+    for media_range in (accept or "").split(","):
+        media_type, _, params = media_range.partition(";")
+        if media_type.strip().lower() != MSGPACK_MEDIA_TYPE:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            return MSGPACK_MEDIA_TYPE
+    return "application/json"
+
+
+def render_payload(payload: Any, media_type: str, headers: Dict[str, str]) -> Response:
+    """Render a response payload in the negotiated media type"""
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return Response(ormsgpack.packb(payload), media_type=MSGPACK_MEDIA_TYPE, headers=headers)
+    return ORJSONResponse(payload, headers=headers)
+
+
 @app.get("/v1/list_aggs", response_model=ListAggsResponse)
 async def list_aggs(
     ticker: str = Query(..., description="Stock ticker symbol (e.g., AAPL)"),
@@ -111,7 +303,10 @@ async def list_aggs(
     from_date: str = Query("2023-01-01", alias="from", description="Start date (YYYY-MM-DD)"),
     to_date: str = Query("2023-06-13", alias="to", description="End date (YYYY-MM-DD)"),
     limit: int = Query(50000, description="Maximum number of results"),
-    max_results: int = Query(100, description="Maximum results to return in response (for display purposes)")
+    max_results: int = Query(100, description="Maximum results to return in response (for display purposes)"),
+    include_count: bool = Query(True, description="Count all matching aggregates; when false, stop fetching once max_results are collected"),
+    if_none_match: Optional[str] = Header(None),
+    accept: Optional[str] = Header(None)
 ):
     """
     Fetch aggregate bars (OHLCV data) for a stock ticker
@@ -121,6 +316,15 @@ async def list_aggs(
     - Volume
     - VWAP (Volume Weighted Average Price) when available
     - Transaction count when available
+    
+    Windows that ended before today only change on corporate actions such as
+    splits, so their responses carry a one-day Cache-Control and a weak ETag
+    that changes daily. A matching If-None-Match returns 304 without
+    contacting Polygon.io on the same day; from the next day the ETag no
+    longer matches, so the bars are fetched again and split adjustments
+    show up within a day.
+    
+    Send `Accept: application/msgpack` to receive MessagePack instead of JSON.
     """
     if not polygon_client:
         raise HTTPException(
@@ -128,49 +332,73 @@ async def list_aggs(
             detail="Polygon client not initialized. Please ensure POLYGON_API_KEY is set."
         )
     
+    media_type = negotiate_media_type(accept)
+    if is_past_date(to_date):
+        etag = aggs_etag(
+            ticker, multiplier, timespan, from_date, to_date, limit, max_results, include_count,
+            media_type
+        )
+        headers = {"ETag": etag, "Cache-Control": "public, max-age=86400", "Vary": "Accept"}
+        if etag_matches(etag, if_none_match):
+            return Response(status_code=304, headers=headers)
+    else:
+        headers = {"Cache-Control": "no-store", "Vary": "Accept"}
+    
     try:
-        logger.info(f"Fetching aggregates for {ticker} from {from_date} to {to_date}")
-        
-        # Fetch aggregates using the polygon client
-        aggs = []
-        for a in polygon_client.list_aggs(
-            ticker=ticker,
-            multiplier=multiplier,
-            timespan=timespan,
-            from_=from_date,
-            to=to_date,
-            limit=limit
-        ):
-            # Convert the aggregate object to our model
-            agg_data = AggregateData(
-                timestamp=a.timestamp,
-                open=a.open,
-                high=a.high,
-                low=a.low,
-                close=a.close,
-                volume=a.volume,
-                vwap=getattr(a, 'vwap', None),
-                transactions=getattr(a, 'transactions', None)
-            )
-            aggs.append(agg_data)
+        logger.info("Fetching aggregates for %s from %s to %s", ticker, from_date, to_date)
         
-        # Limit results for response (but log total count)
-        display_aggs = aggs[:max_results]
-        note = None
-        if len(aggs) > max_results:
-            note = f"Showing first {max_results} of {len(aggs)} total aggregates"
+        # The polygon client is blocking, so iterate it off the event loop
+        payload = await asyncio.to_thread(
+            fetch_aggs,
+            ticker, multiplier, timespan, from_date, to_date, limit, max_results, include_count
+        )
+        logger.info("Successfully fetched %d aggregates for %s", payload["count"], ticker)
         
-        logger.info(f"Successfully fetched {len(aggs)} aggregates for {ticker}")
+        # Return the payload directly so FastAPI does not re-validate every
+        # row against response_model, which only documents the schema here
+        return render_payload(payload, media_type, headers)
         
-        return ListAggsResponse(
-            ticker=ticker,
-            timespan=f"{multiplier} {timespan}",
-            from_date=from_date,
-            to_date=to_date,
-            count=len(aggs),
-            aggregates=display_aggs,
-            note=note
+    except Exception as e:
+        logger.error(f"Error fetching aggregates: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching aggregates: {str(e)}")
+
+
+@app.post("/v1/list_aggs:batch", response_model=List[ListAggsResponse])
+async def list_aggs_batch(
+    queries: List[ListAggsQuery],
+    accept: Optional[str] = Header(None)
+):
+    """
+    Fetch aggregate bars for several queries in a single request
+    
+    Queries run concurrently and results are returned in request order.
+    Send `Accept: application/msgpack` to receive MessagePack instead of JSON.
+    """
+    if not polygon_client:
+        raise HTTPException(
+            status_code=503, 
+            detail="Polygon client not initialized. Please ensure POLYGON_API_KEY is set."
         )
+    if len(queries) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch size {len(queries)} exceeds the maximum of {MAX_BATCH_SIZE}"
+        )
+    
+    try:
+        logger.info("Fetching aggregates for batch of %d queries", len(queries))
+        
+        payloads = await asyncio.gather(*(
+            asyncio.to_thread(
+                fetch_aggs,
+                q.ticker, q.multiplier, q.timespan, q.from_date, q.to_date,
+                q.limit, q.max_results, q.include_count
+            )
+            for q in queries
+        ))
+        logger.info("Successfully fetched batch of %d queries", len(payloads))
+        
+        return render_payload(payloads, negotiate_media_type(accept), {"Vary": "Accept"})
         
     except Exception as e:
         logger.error(f"Error fetching aggregates: {str(e)}")
@@ -185,10 +413,19 @@ if __name__ == "__main__":
     logger.info(f"Starting Polygon HTTP API Server on {host}:{port}")
     
     # Run the server
-    uvicorn.run(
-        "server:app",
-        host=host,
-        port=port,
-        log_level="info",
-        reload=True  # Enable auto-reload for development
-    )
+    if os.getenv("POLY_MCP_DEV"):
+        uvicorn.run(
+            "server:app",
+            host=host,
+            port=port,
+            log_level="info",
+            reload=True  # Enable auto-reload for development
+        )
+    else:
+        uvicorn.run(
+            "server:app",
+            host=host,
+            port=port,
+            log_level="info",
+            workers=int(os.getenv("POLY_MCP_WORKERS", os.cpu_count() or 1))
+        )
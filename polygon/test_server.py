@@ -7,25 +7,38 @@ import requests
 import json
 import sys
 
+import ormsgpack
+
 BASE_URL = "http://localhost:3000"
 
-def test_endpoint(endpoint, description):
-    """Test a single endpoint"""
+def test_endpoint(endpoint, description, method="GET", body=None, headers=None,
+                  expected_status=200, expected_content_type="application/json"):
+    """Test a single endpoint and return its response (None if the request failed)"""
     print(f"\n🧪 Testing {description}")
-    print(f"GET {BASE_URL}{endpoint}")
+    print(f"{method} {BASE_URL}{endpoint}")
     print("-" * 50)
     
     try:
-        response = requests.get(f"{BASE_URL}{endpoint}", timeout=10)
+        response = requests.request(method, f"{BASE_URL}{endpoint}", json=body, headers=headers, timeout=10)
+        content_type = response.headers.get("Content-Type", "")
         print(f"Status: {response.status_code}")
         
-        if response.status_code == 200:
-            data = response.json()
-            print("✅ Success!")
-            print(json.dumps(data, indent=2)[:500] + "..." if len(json.dumps(data, indent=2)) > 500 else json.dumps(data, indent=2))
-        else:
+        if response.status_code != expected_status:
             print(f"❌ Error: {response.status_code}")
             print(response.text)
+        elif expected_content_type and not content_type.startswith(expected_content_type):
+            print(f"❌ Error: expected {expected_content_type}, got {content_type}")
+        else:
+            print("✅ Success!")
+            if content_type.startswith("application/msgpack"):
+                data = ormsgpack.unpackb(response.content)
+            elif content_type.startswith("application/json"):
+                data = response.json()
+            else:
+                data = None
+            if data is not None:
+                print(json.dumps(data, indent=2)[:500] + "..." if len(json.dumps(data, indent=2)) > 500 else json.dumps(data, indent=2))
+        return response
             
     except requests.exceptions.ConnectionError:
         print("❌ Connection Error - Is the server running on localhost:3000?")
@@ -33,6 +46,7 @@ def test_endpoint(endpoint, description):
         print("❌ Timeout - Server took too long to respond")
     except Exception as e:
         print(f"❌ Error: {str(e)}")
+    return None
 
 def main():
     print("🚀 Polygon HTTP API Server Test")
@@ -43,7 +57,33 @@ def main():
     test_endpoint("/health", "Health check")
     
     # Test the main API endpoint
-    test_endpoint("/v1/list_aggs?ticker=AAPL&max_results=3", "List aggregates (limited results)")
+    response = test_endpoint("/v1/list_aggs?ticker=AAPL&max_results=3", "List aggregates (limited results)")
+    
+    # Repeating a past-window request with its ETag should return 304
+    etag = response.headers.get("ETag") if response is not None else None
+    if etag:
+        test_endpoint(
+            "/v1/list_aggs?ticker=AAPL&max_results=3",
+            "List aggregates conditional request (304)",
+            headers={"If-None-Match": etag},
+            expected_status=304,
+            expected_content_type=None
+        )
+    else:
+        print("\n❌ No ETag on list_aggs response, skipping conditional request test")
+    
+    test_endpoint(
+        "/v1/list_aggs?ticker=AAPL&max_results=3",
+        "List aggregates as MessagePack",
+        headers={"Accept": "application/msgpack"},
+        expected_content_type="application/msgpack"
+    )
+    test_endpoint(
+        "/v1/list_aggs:batch",
+        "Batch list aggregates",
+        method="POST",
+        body=[{"ticker": "AAPL", "max_results": 3}, {"ticker": "GDDY", "max_results": 3}]
+    )
     
     print("\n" + "=" * 50)
     print("✨ Test complete!")